@@ -1,24 +1,33 @@
 """
-Use this script for queries >1M rows to export to chunked Excel files.
+Use this script for queries >1M rows to export to chunked CSV files or a single Parquet file.
 
 HOW TO USE:
 1. Ensure that the connection to the PostgreSQL database is working. Change your password if necessary.
 2. Prepare your query to export by creating a materialized view called `sandbox.export_o` along with an `rn` column to enumerate the rows starting from 1.
     - Paste this for unordered row numbers: `ROW_NUMBER() OVER () AS rn`
-4. Specify `TASK_NUMBER` for the filename.
+4. Specify `TASK_NUMBER` for the filename and `OUTPUT_FORMAT` for the file type.
+    - For CSV exports from a remote database, `NUM_CONNECTIONS` can be raised to fetch several parts in parallel.
 5. Run the file.
 6. Get your exports from the `outputs` file.
 """
 
-import os
+import asyncio
 import math
+import os
 import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
 import sqlalchemy
 import urllib.parse
 from dotenv import load_dotenv
 from pathlib import Path
 from sqlalchemy import text
 
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
 
 # Adjust these parameters
 TASK_NUMBER = "cncp"
@@ -26,6 +35,8 @@ TASK_NUMBER = "cncp"
 CHUNK_SIZE = 1_000_000
 MATVIEW_NAME = "sandbox.export_o"
 SAVE_DIR = "outputs"
+OUTPUT_FORMAT = "parquet"  # "csv" for chunked CSV files, "parquet" for a single Parquet file
+NUM_CONNECTIONS = 1  # >1 exports CSV parts in parallel, one connection per part; best with an index on `rn`
 
 
 load_dotenv()
@@ -34,23 +45,246 @@ Path(SAVE_DIR).mkdir(parents=True, exist_ok=True)
 password = os.getenv("PW")
 encoded_password = urllib.parse.quote(password)
 
-engine = sqlalchemy.create_engine(f"postgresql://odilbek.tohirov:{encoded_password}@{os.getenv("IP")}:{os.getenv("PORT")}/dwh_db")
+DSN = f"postgresql://odilbek.tohirov:{encoded_password}@{os.getenv("IP")}:{os.getenv("PORT")}/dwh_db"
+engine = sqlalchemy.create_engine(DSN)
+
+
+def filename_for(part_number: int) -> str:
+    return f"{SAVE_DIR}/{TASK_NUMBER}_part{part_number}.csv"
+
+
+class LineRotatingWriter:
+    """
+    File-like sink for `COPY ... TO STDOUT WITH CSV HEADER` that splits the stream into parts of `CHUNK_SIZE` rows.
+
+    Rows are counted by newline bytes outside quoted fields, so values with embedded line breaks are never split.
+    The header line is repeated at the top of every part. A part is only opened once its first row arrives.
+    """
+
+    def __init__(self, chunk_size: int):
+        self.chunk_size = chunk_size
+        self.header = b""
+        self.header_done = False
+        self.in_quotes = False
+        self.rows_in_part = 0
+        self.num_parts = 0
+        self.file = None
+
+    def write(self, data: bytes) -> None:
+        # Fast path: no quoting and no part boundary within this block, so it is copied as-is
+        if self.file is not None and not self.in_quotes and b'"' not in data:
+            num_lines = data.count(b"\n")
+            if self.rows_in_part + num_lines < self.chunk_size:
+                self.file.write(data)
+                self.rows_in_part += num_lines
+                return
+
+        *records, tail = data.split(b"\n")
+        for record in records:
+            self._write_piece(record + b"\n", ends_line=True)
+        if tail:
+            self._write_piece(tail, ends_line=False)
+
+    def _write_piece(self, piece: bytes, ends_line: bool) -> None:
+        # Doubled quotes inside a quoted field flip the state twice, so the parity of `"` is enough
+        if piece.count(b'"') % 2:
+            self.in_quotes = not self.in_quotes
+        record_done = ends_line and not self.in_quotes
+
+        if not self.header_done:
+            self.header += piece
+            self.header_done = record_done
+            return
+
+        if self.file is None:
+            self._open_next_part()
+        self.file.write(piece)
+
+        if record_done:
+            self.rows_in_part += 1
+            if self.rows_in_part == self.chunk_size:
+                self._close_part()
+
+    def _open_next_part(self) -> None:
+        self.num_parts += 1
+        self.file = open(filename_for(self.num_parts), "wb")
+        self.file.write(self.header)
+        self.rows_in_part = 0
+
+    def _close_part(self) -> None:
+        self.file.close()
+        print(f"Saved {self.file.name}")
+        self.file = None
+
+    def abort(self) -> None:
+        """
+        Closes and removes the part that was being written when the export failed.
+        """
+        if self.file is not None:
+            self.file.close()
+            os.remove(self.file.name)
+            print(f"Removed incomplete {self.file.name}")
+            self.file = None
+            self.num_parts -= 1
+
+    def close(self) -> None:
+        if self.file is None and self.num_parts == 0:
+            # The view is empty; still produce a file with the header
+            self._open_next_part()
+        if self.file is not None:
+            self._close_part()
+
 
-with engine.connect() as conn:
-    total_rows = conn.execute(text(f"SELECT COUNT(*) FROM {MATVIEW_NAME}")).scalar()
+def export_csv() -> None:
+    """
+    Exports the view to CSV part files of `CHUNK_SIZE` rows each.
 
-NUM_CHUNKS = math.ceil(total_rows / CHUNK_SIZE)
+    The server serializes the rows to CSV itself and a single sequential scan is streamed into the part files,
+    so no rows are materialized as Python objects.
+    """
+    query = f"COPY (SELECT * FROM {MATVIEW_NAME} ORDER BY rn) TO STDOUT WITH CSV HEADER"
+    writer = LineRotatingWriter(CHUNK_SIZE)
 
-for i in range(NUM_CHUNKS):
-    lower = i * CHUNK_SIZE + 1
-    upper = (i + 1) * CHUNK_SIZE
+    raw_conn = engine.raw_connection()
+    try:
+        with raw_conn.cursor() as cur:
+            cur.copy_expert(query, writer)
+    except BaseException:
+        writer.abort()
+        print(f"Export failed, {writer.num_parts} complete part(s) kept")
+        raise
+    finally:
+        raw_conn.close()
+    writer.close()
 
-    if NUM_CHUNKS == 1:
+    # The number of parts is only known once the stream is exhausted, so a single-part export is renamed afterward
+    if writer.num_parts == 1:
         filename = f"{SAVE_DIR}/{TASK_NUMBER}.csv"
-    else:
-        filename = f"{SAVE_DIR}/{TASK_NUMBER}_part{i + 1}.csv"
+        os.replace(filename_for(1), filename)
+        print(f"Renamed to {filename}")
+
+
+async def export_csv_parallel() -> None:
+    """
+    Exports the view to CSV part files of `CHUNK_SIZE` rows each, fetching up to `NUM_CONNECTIONS` parts at a time.
+
+    Every part is a separate `COPY` of an `rn` range on its own connection, which overlaps the network round trips
+    when the database is remote. Unless `rn` is indexed, each part scans the whole view on the server.
+    The first batch of parts is sized from the planner's row estimate instead of a `COUNT(*)` scan;
+    parts keep being fetched until one comes back with fewer than `CHUNK_SIZE` rows, which cancels the parts after it.
+    """
+    if asyncpg is None:
+        raise ImportError("asyncpg is required to export with NUM_CONNECTIONS > 1")
+
+    async with asyncpg.create_pool(DSN, min_size=NUM_CONNECTIONS, max_size=NUM_CONNECTIONS) as pool:
+        # -1 if the view has never been analyzed
+        estimated_rows = await pool.fetchval(f"SELECT reltuples::bigint FROM pg_class WHERE oid = '{MATVIEW_NAME}'::regclass")
+
+        saved_parts = []
+        tasks: dict[int, asyncio.Task] = {}
+
+        async def export_chunk(i: int) -> int:
+            lower = i * CHUNK_SIZE + 1
+            upper = (i + 1) * CHUNK_SIZE
+            filename = filename_for(i + 1)
+            tmp_filename = f"{filename}.partial"
+
+            query = f"SELECT * FROM {MATVIEW_NAME} WHERE rn BETWEEN {lower} AND {upper} ORDER BY rn"
+            try:
+                async with pool.acquire() as conn:
+                    status = await conn.copy_from_query(query, output=tmp_filename, format="csv", header=True)
+            except BaseException:
+                # Also reached when the part is cancelled because another part failed
+                if os.path.exists(tmp_filename):
+                    os.remove(tmp_filename)
+                raise
+            num_rows = int(status.split()[-1])
+
+            # Parts past the end of an overestimated view are empty; the first one is kept so an empty view still gets a file
+            if num_rows == 0 and i > 0:
+                os.remove(tmp_filename)
+            else:
+                os.replace(tmp_filename, filename)
+                saved_parts.append(filename)
+                print(f"Saved {filename}")
+
+            if num_rows < CHUNK_SIZE:
+                # This is the last part of the view, so the parts after it would only scan for nothing
+                for j, task in tasks.items():
+                    if j > i:
+                        task.cancel()
+            return num_rows
+
+        batch_size = max(math.ceil(estimated_rows / CHUNK_SIZE), 1)
+        last_part_found = False
+        try:
+            while not last_part_found:
+                start = len(tasks)
+                # A failing part cancels the rest of the batch
+                async with asyncio.TaskGroup() as tg:
+                    for i in range(start, start + batch_size):
+                        tasks[i] = tg.create_task(export_chunk(i))
+                # Parts are only cancelled once a part before them came back short
+                last_part_found = any(tasks[i].cancelled() or tasks[i].result() < CHUNK_SIZE for i in range(start, len(tasks)))
+                batch_size = NUM_CONNECTIONS
+        except BaseException:
+            print(f"Export failed, {len(saved_parts)} complete part(s) kept")
+            raise
+
+    # The number of parts is only known once the last part is fetched, so a single-part export is renamed afterward
+    if len(saved_parts) == 1:
+        filename = f"{SAVE_DIR}/{TASK_NUMBER}.csv"
+        os.replace(filename_for(1), filename)
+        print(f"Renamed to {filename}")
+
+
+def export_parquet() -> None:
+    """
+    Exports the view to a single Parquet file, writing one row group per `CHUNK_SIZE` rows.
+
+    Rows are streamed through a server-side cursor so only one chunk is held in memory at a time.
+    The schema is taken from the first chunk, with columns that are entirely NULL there stored as strings,
+    and every following chunk is cast to it.
+    The file is written under a temporary name and only renamed once the whole view has been exported.
+    """
+    query = text(f"SELECT * FROM {MATVIEW_NAME} ORDER BY rn")
+    filename = f"{SAVE_DIR}/{TASK_NUMBER}.parquet"
+    tmp_filename = f"{filename}.partial"
+    writer = None
+
+    try:
+        with engine.connect().execution_options(stream_results=True, yield_per=CHUNK_SIZE) as conn:
+            for i, df in enumerate(pd.read_sql(query, conn, chunksize=CHUNK_SIZE)):
+                table = pa.Table.from_pandas(df, preserve_index=False)
+                if writer is None:
+                    # A column without values in the first chunk has no type yet; later chunks can be cast to strings
+                    schema = pa.schema(
+                        [field.with_type(pa.string()) if pa.types.is_null(field.type) else field for field in table.schema],
+                        metadata=table.schema.metadata,
+                    )
+                    writer = pq.ParquetWriter(tmp_filename, schema)
+                writer.write_table(table.cast(writer.schema))
+                print(f"Written chunk {i + 1} to {tmp_filename}")
+    except BaseException:
+        if writer is not None:
+            writer.close()
+            os.remove(tmp_filename)
+        raise
+
+    if writer is None:
+        print(f"{MATVIEW_NAME} returned no rows, nothing was saved")
+        return
+
+    writer.close()
+    os.replace(tmp_filename, filename)
+    print(f"Saved {filename}")
+
 
-    query = f"SELECT * FROM {MATVIEW_NAME} WHERE rn BETWEEN {lower} AND {upper} ORDER BY rn"
-    df = pd.read_sql(query, engine)
-    df.to_csv(filename, index=False)
-    print(f"Saved {filename}")
\ No newline at end of file
+if OUTPUT_FORMAT == "csv" and NUM_CONNECTIONS > 1:
+    asyncio.run(export_csv_parallel())
+elif OUTPUT_FORMAT == "csv":
+    export_csv()
+elif OUTPUT_FORMAT == "parquet":
+    export_parquet()
+else:
+    raise ValueError(f"Unsupported OUTPUT_FORMAT: {OUTPUT_FORMAT!r}")
@@ -9,12 +9,23 @@ How to use:
 
 import datetime
 import logging
+import math
+import os
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
+from typing import Iterator
 
 import numpy as np
+import openpyxl
 import pandas as pd
+import pyarrow as pa
 from pandas import DataFrame
 
+try:
+    import numba
+except ImportError:
+    numba = None
+
 CURR_DATETIME = datetime.datetime.now()
 SCRIPT_DIR = Path(__file__).resolve().parent
 
@@ -28,33 +39,57 @@ OUTPUT_LOGS_PATH = LOGS_DIR / f"logs_{timestamp}.txt"
 # Specify which columns you wish to extract and save in the final output file
 COLUMNS_TEMPLATE = ("Date/Period", "Lead Time", "Cycle Time", "Blocked Time", "Time to Market", "Analysis Time")
 COLUMNS_TEMPLATE_LOWER = [x.lower() for x in COLUMNS_TEMPLATE]
+COLUMNS_TEMPLATE_BY_LOWER = {x.lower(): x for x in COLUMNS_TEMPLATE}
+
+# PyArrow-backed strings can only be extracted with named groups and a pattern string, so the patterns are kept as strings.
+# `Date/Period` values such as `1/Jan/24 - 7/Jan/24 (Week #1)`
+DATE_PERIOD_PATTERN = (
+    r"(?P<PeriodStart>\d{1,2}/\w{3}/\d{2})\s+-\s+(?P<PeriodEnd>\d{1,2}/\w{3}/\d{2})\s+\([Ww][Ee]{2}[Kk]\s+#(?P<WeekNumber>\d+)\)"
+)
+# Time values such as `10d 5h 3m`
+TIME_DHM_PATTERN = r"(?:(?P<Days>\d+)d\s*)?(?:(?P<Hours>\d+)h\s*)?(?:(?P<Minutes>\d+)m\s*)?"
 
 
 def ensure_dir(path: Path):
     path.mkdir(parents=True, exist_ok=True)
 
 
-def rename_excel_files(dir_to_search: Path) -> None:
+def walk_xlsx(root: Path) -> Iterator[os.DirEntry]:
     """
-    Searches for and renames all "AVG.xlsx" files to their parent directories' names.
+    Yields all Excel files under a directory, searching its child directories too.
 
-    The `dir_to_search`'s all child files and directories are searched.
-    If a file called "AVG.xlsx" is found, it is renamed to its parent directory's name.
+    Uses `os.scandir`, whose entries cache the file type, so no extra `stat` calls are made per file.
+    Symlinked directories are not followed and directories that cannot be read are skipped.
+    Names are matched case-insensitively only where the filesystem is, as `Path.rglob` does.
 
     Args:
-        dir_to_search: Path of directory to search.
+        root: Path of directory to search.
+
+    Yields:
+        Directory entries of the found Excel files.
     """
-    for avg_file in dir_to_search.rglob("AVG*.xlsx"):
-        new_name = avg_file.parent / f"{avg_file.parent.name}.xlsx"
-        avg_file.rename(new_name)
+    stack = [root]
+    while stack:
+        try:
+            it = os.scandir(stack.pop())
+        except PermissionError:
+            # Unreadable directories are skipped, as `Path.rglob` does
+            continue
+        with it:
+            for entry in it:
+                if entry.is_dir(follow_symlinks=False):
+                    stack.append(entry.path)
+                elif os.path.normcase(entry.name).endswith(os.path.normcase(".xlsx")):
+                    yield entry
 
 
-def get_excel_filepaths(dir_to_search: Path) -> list[Path]:
+def rename_and_get_excel_filepaths(dir_to_search: Path) -> list[Path]:
     """
-    Searches for and obtains the absolute filepaths of certain Excel files.
+    Renames all "AVG.xlsx" files to their parent directories' names and obtains the absolute filepaths of the department Excel files.
 
-    The `dir_to_search`'s all child files and directories are searched.
-    The Excel's filepath is saved if the directory name and the child Excel's stem match.
+    The `dir_to_search`'s all child files and directories are searched only once.
+    If a file called "AVG.xlsx" is found, it is renamed to its parent directory's name.
+    The Excel's filepath is saved if the directory name and the child Excel's stem match, after renaming.
 
     Args:
         dir_to_search: Path of directory to search.
@@ -62,12 +97,61 @@ def get_excel_filepaths(dir_to_search: Path) -> list[Path]:
     Returns:
         List of matching absolute Excel filepaths.
     """
-    excel_filepaths = [
-        excel_filepath
-        for excel_filepath in dir_to_search.rglob("*.xlsx")
-        if excel_filepath.stem == excel_filepath.parent.name
-    ]
-    return excel_filepaths
+    # Collected first, as renaming while a directory is being scanned may list the renamed file again
+    excel_files = [Path(entry.path) for entry in walk_xlsx(dir_to_search)]
+
+    # A dict keeps the order and drops a department file that is also the target of a rename
+    excel_filepaths = {}
+    for excel_file in excel_files:
+        if os.path.normcase(excel_file.name).startswith(os.path.normcase("AVG")):
+            new_name = excel_file.parent / f"{excel_file.parent.name}.xlsx"
+            excel_file.rename(new_name)
+            excel_filepaths[new_name] = None
+        elif excel_file.stem == excel_file.parent.name:
+            excel_filepaths[excel_file] = None
+    return list(excel_filepaths)
+
+
+def read_excel_file(excel_filepath: Path) -> DataFrame:
+    """
+    Reads the first worksheet of an Excel file into a dataframe.
+
+    The workbook is opened in read-only mode and its values are streamed row by row, which is much faster than `pd.read_excel`.
+    The first row is used as the header and trailing rows without any values are dropped, as `pd.read_excel` does.
+    Duplicate header names are made unique the same way.
+    Columns use PyArrow-backed dtypes.
+
+    Args:
+        excel_filepath: Excel file to read.
+
+    Returns:
+        Dataframe with the worksheet's values.
+    """
+    wb = openpyxl.load_workbook(excel_filepath, read_only=True, data_only=True)
+    try:
+        rows = wb.worksheets[0].iter_rows(values_only=True)
+        header = next(rows, ())
+        data = list(rows)
+    finally:
+        wb.close()
+
+    # Formatted but empty rows are reported at the end of read-only worksheets
+    while data and all(value is None for value in data[-1]):
+        data.pop()
+
+    columns = [f"Unnamed: {i}" if name is None else str(name) for i, name in enumerate(header)]
+    # Duplicate names get `.1`, `.2`, ... suffixes, as `pd.read_excel` does
+    counts = {}
+    for i, name in enumerate(columns):
+        count = counts.get(name, 0)
+        while count > 0:
+            counts[name] = count + 1
+            name = f"{name}.{count}"
+            count = counts.get(name, 0)
+        columns[i] = name
+        counts[name] = count + 1
+    # Arrow-backed columns keep the strings in native buffers, which the RegEx extraction and the `_parse_dhm` kernel read directly
+    return pd.DataFrame(data, columns=columns).convert_dtypes(dtype_backend="pyarrow")
 
 
 def preprocess_columns(df: DataFrame, excel_filepath: Path) -> DataFrame:
@@ -88,21 +172,16 @@ def preprocess_columns(df: DataFrame, excel_filepath: Path) -> DataFrame:
         Output dataframe after preprocessing.
     """
     df.columns = df.columns.str.replace("⊞", "")
-    mask = df.columns.str.lower().isin(COLUMNS_TEMPLATE_LOWER)
+    cols_lower = df.columns.str.lower().to_numpy()
+    mask = np.isin(cols_lower, COLUMNS_TEMPLATE_LOWER)
     df = df.loc[:, mask]
+    cols_lower = cols_lower[mask]
+    found_cols_lower = set(cols_lower)
     for col in COLUMNS_TEMPLATE:
-        if col.lower() not in df.columns.str.lower():
+        if col.lower() not in found_cols_lower:
             logging.info(f"Колонка '{col}' не существует в файле '{excel_filepath.name}'\n")
 
-    col_rename_mapper = {}
-    for c1 in df.columns:
-        if c1 in COLUMNS_TEMPLATE:
-            continue
-        for c2 in COLUMNS_TEMPLATE:
-            if c1.lower() == c2.lower():
-                col_rename_mapper[c1] = c2
-                break
-    df = df.rename(columns=col_rename_mapper)
+    df.columns = [COLUMNS_TEMPLATE_BY_LOWER[c] for c in cols_lower]
 
     df = df.reindex(columns=COLUMNS_TEMPLATE)
     return df
@@ -112,7 +191,8 @@ def split_date_col(df: DataFrame) -> DataFrame:
     """
     Splits and replaces the `Date/Period` column of an input dataframe into three columns: `Period Start`, `Period End`, and `Week Number`.
 
-    Uses RegEx to parse the string.
+    Uses RegEx to parse the string. The period dates are parsed as datetimes (`1/Jan/24` format) and the week number as an integer.
+    Values that cannot be parsed are treated as missing. If `Date/Period` has no values at all, the parsing is skipped.
 
     Args:
         df: Dataframe to transform.
@@ -120,22 +200,181 @@ def split_date_col(df: DataFrame) -> DataFrame:
     Returns:
         Dataframe with the new columns.
     """
-    regex_pattern = r"(\d{1,2}/\w{3}/\d{2})\s+-\s+(\d{1,2}/\w{3}/\d{2})\s+\([Ww][Ee]{2}[Kk]\s+#(\d+)\)"
-    df_ = df["Date/Period"].str.extract(regex_pattern).rename(
-        columns={0: "Period Start", 1: "Period End", 2: "Week Number"})
+    if df.empty or df["Date/Period"].isna().all():
+        # Nothing to parse, e.g. the `Date/Period` column is missing from the department's file
+        df_ = pd.DataFrame({
+            "Period Start": pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]"),
+            "Period End": pd.Series(pd.NaT, index=df.index, dtype="datetime64[ns]"),
+            "Week Number": pd.Series(pd.NA, index=df.index, dtype="Int16"),
+        })
+    else:
+        df_ = df["Date/Period"].str.extract(DATE_PERIOD_PATTERN).rename(
+            columns={"PeriodStart": "Period Start", "PeriodEnd": "Period End", "WeekNumber": "Week Number"})
+        df_["Period Start"] = pd.to_datetime(df_["Period Start"], format="%d/%b/%y", errors="coerce")
+        df_["Period End"] = pd.to_datetime(df_["Period End"], format="%d/%b/%y", errors="coerce")
+        df_["Week Number"] = pd.to_numeric(df_["Week Number"], errors="coerce").astype("Int16")
     df.drop("Date/Period", axis=1, inplace=True)
     df = pd.concat([df_, df], axis=1)
     return df
 
 
+def _whitespace_len(buf: np.ndarray, j: int, end: int) -> int:
+    """
+    Returns the length in bytes of the UTF-8 encoded whitespace character at `buf[j]`, or 0 if there is none.
+
+    The same characters as `str.isspace` (and so `\s` in `TIME_DHM_PATTERN`) are treated as whitespace.
+    """
+    b = buf[j]
+    if b == 32 or 9 <= b <= 13 or 28 <= b <= 31:
+        return 1
+    if b == 0xC2 and j + 1 < end and (buf[j + 1] == 0x85 or buf[j + 1] == 0xA0):
+        return 2  # U+0085, U+00A0
+    if j + 2 >= end:
+        return 0
+    b1 = buf[j + 1]
+    b2 = buf[j + 2]
+    if b == 0xE1 and b1 == 0x9A and b2 == 0x80:
+        return 3  # U+1680
+    if b == 0xE2 and b1 == 0x80 and (0x80 <= b2 <= 0x8A or b2 == 0xA8 or b2 == 0xA9 or b2 == 0xAF):
+        return 3  # U+2000-U+200A, U+2028, U+2029, U+202F
+    if b == 0xE2 and b1 == 0x81 and b2 == 0x9F:
+        return 3  # U+205F
+    if b == 0xE3 and b1 == 0x80 and b2 == 0x80:
+        return 3  # U+3000
+    return 0
+
+
+if numba is not None:
+    _whitespace_len = numba.njit(cache=True)(_whitespace_len)
+
+
+def _parse_dhm(buf: np.ndarray, offsets: np.ndarray, is_str: np.ndarray, out: np.ndarray) -> None:
+    """
+    Parses UTF-8 encoded `XXd XXh XXm` values into total hours in a single pass over their bytes.
+
+    Matches the same values as `TIME_DHM_PATTERN`: an optional `<digits>d`, `<digits>h` and `<digits>m`, in that order, are read from the start of each value,
+    each followed by optional whitespace. Values where none of them match are left as NaN in `out`.
+
+    Args:
+        buf: Concatenated bytes of all values.
+        offsets: Start offset of each value in `buf`, followed by the total length.
+        is_str: Mask of the values that are strings; the rest are left as NaN.
+        out: Output array of total hours, pre-filled with NaN.
+    """
+    units = (100, 104, 109)  # b"d", b"h", b"m"
+    for i in range(len(is_str)):
+        if not is_str[i]:
+            continue
+        pos = offsets[i]
+        end = offsets[i + 1]
+        days = hours = minutes = 0.0
+        found = False
+        for k in range(3):
+            j = pos
+            value = 0.0
+            while j < end and 48 <= buf[j] <= 57:
+                value = value * 10 + (buf[j] - 48)
+                j += 1
+            if j == pos or j == end or buf[j] != units[k]:
+                continue
+            if k == 0:
+                days = value
+            elif k == 1:
+                hours = value
+            else:
+                minutes = value
+            found = True
+            j += 1
+            while j < end:
+                n = _whitespace_len(buf, j, end)
+                if n == 0:
+                    break
+                j += n
+            pos = j
+        if found:
+            out[i] = days * 24 + hours + math.ceil(minutes / 60)
+
+
+if numba is not None:
+    _parse_dhm = numba.njit(cache=True)(_parse_dhm)
+
+
+def _utf8_buffers(col: pd.Series) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Obtains the UTF-8 bytes of a string column in the layout expected by `_parse_dhm`.
+
+    PyArrow-backed columns already store their values this way, so their data buffer is used as-is instead of encoding every value.
+    Other columns are encoded value by value.
+
+    Args:
+        col: String column.
+
+    Returns:
+        Concatenated bytes, offsets of every value, and the mask of values that are strings.
+    """
+    if isinstance(col.dtype, pd.ArrowDtype) or (isinstance(col.dtype, pd.StringDtype) and col.dtype.storage == "pyarrow"):
+        arr = col.array.__arrow_array__().combine_chunks().cast(pa.large_string())
+        _, offsets_buf, data_buf = arr.buffers()
+        offsets = np.frombuffer(offsets_buf, dtype=np.int64)[arr.offset:arr.offset + len(arr) + 1]
+        buf = np.frombuffer(data_buf, dtype=np.uint8) if data_buf is not None else np.empty(0, dtype=np.uint8)
+        is_str = arr.is_valid().to_numpy(zero_copy_only=False)
+        return buf, offsets, is_str
+
+    values = col.to_numpy(dtype=object)
+    is_str = np.fromiter((isinstance(v, str) for v in values), dtype=np.bool_, count=len(values))
+    encoded = [v.encode() if s else b"" for v, s in zip(values, is_str)]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(e) for e in encoded], out=offsets[1:])
+    buf = np.frombuffer(b"".join(encoded), dtype=np.uint8)
+    return buf, offsets, is_str
+
+
+def _total_hours_numba(col: pd.Series) -> pd.Series:
+    """
+    Converts a time column to total hours with the compiled `_parse_dhm` kernel.
+
+    Args:
+        col: Time column to convert.
+
+    Returns:
+        Total hours of every value.
+    """
+    buf, offsets, is_str = _utf8_buffers(col)
+    out = np.full(len(col), np.nan)
+    _parse_dhm(buf, offsets, is_str, out)
+    return pd.Series(out, index=col.index, name=col.name)
+
+
+def _total_hours_regex(col: pd.Series) -> pd.Series:
+    """
+    Converts a time column to total hours with `TIME_DHM_PATTERN`.
+
+    Args:
+        col: Time column to convert.
+
+    Returns:
+        Total hours of every value.
+    """
+    df_dhm = col.str.extract(TIME_DHM_PATTERN, expand=True)
+    # PyArrow-backed strings give empty strings instead of missing values for the groups that did not match
+    df_dhm = df_dhm.replace("", np.nan).astype("float64")
+    # Rows with at least one numeric value get their other NaNs filled with 0 to calculate the total hours
+    has_value = df_dhm.notna().any(axis=1).to_numpy()
+    df_dhm = df_dhm.fillna(0)
+    df_dhm.loc[~has_value, :] = np.nan
+    return (df_dhm["Days"] * 24) + df_dhm["Hours"] + np.ceil(df_dhm["Minutes"] / 60)
+
+
 def convert_time_cols(df: DataFrame, columns_to_process: list) -> DataFrame:
     """
     Converts the specified list of columns from `XXd XXh XXm` format to total hours.
 
     Uses RegEx to parse the string values. The RegEx pattern can handle cases such as `XXd Xh`, `Xm`, `XdXh`. Values that do not match the RegEx pattern are treated as NaN.
+    If `numba` is installed, the values are parsed by an equivalent compiled kernel instead.
     Minutes are converted and ceiled to the nearest hour.
     Assumes that the input dataframe already has the columns given in `columns_to_process`.
     For example, `10d 5h 3m` is converted to `246`, `1m` is converted to `1`, `-` is converted to NaN.
+    Columns without any values are not parsed and become NaN. Numeric columns are kept as they are, cast to float.
 
     Args:
         columns_to_process: Time columns that must be converted.
@@ -144,53 +383,82 @@ def convert_time_cols(df: DataFrame, columns_to_process: list) -> DataFrame:
     Returns:
         Dataframe with the new columns.
     """
+    if df.empty:
+        return df
 
-    def process_nans(row: pd.Series) -> pd.Series:
-        """
-        Fills NaN values of rows that have at least one numeric value with 0.
-        Necessary to calculate the total hours downstream.
-        """
-        if row.notna().any():
-            return row.fillna(0)
-        return row
-
-    regex_pattern = r"(?:(?P<Days>\d+)d\s*)?(?:(?P<Hours>\d+)h\s*)?(?:(?P<Minutes>\d+)m\s*)?"
-
+    total_hours = _total_hours_regex if numba is None else _total_hours_numba
     for col in columns_to_process:
-        if df[col].dtype != "object":
-            continue
-        df_dhm = df[col].str.extract(regex_pattern, expand=True)
-        df_dhm = df_dhm.apply(pd.to_numeric)
-        df_dhm = df_dhm.apply(process_nans, axis=1)
-        total_hours = (df_dhm["Days"] * 24) + df_dhm["Hours"] + np.ceil(df_dhm["Minutes"] / 60)
-        df[col] = total_hours
+        if df[col].isna().all():
+            # Nothing to parse; the column becomes NaN hours as it would after parsing
+            df[col] = np.nan
+        elif pd.api.types.is_string_dtype(df[col].dtype):
+            df[col] = total_hours(df[col])
+        elif pd.api.types.is_numeric_dtype(df[col].dtype):
+            # Already in hours; cast to float so that every file's column is written the same way, e.g. `5.0` and not `5`
+            df[col] = df[col].astype("float64")
     return df
 
 
-def main():
-    ensure_dir(OUTPUT_DIR)
-    ensure_dir(LOGS_DIR)
+def setup_logging(log_path: Path) -> None:
+    """
+    Configures logging to the given file.
 
+    Also used as the process pool initializer, so that messages from the worker processes reach the same log file.
+
+    Args:
+        log_path: Path of the log file.
+    """
     logging.basicConfig(
-        filename=OUTPUT_LOGS_PATH,
+        filename=log_path,
         level=logging.INFO,
     )
 
-    rename_excel_files(SCRIPT_DIR)
-    excel_filepaths = get_excel_filepaths(SCRIPT_DIR)
-
-    transformed_dfs = []
-    for filepath in excel_filepaths:
-        df = pd.read_excel(filepath)
-        df = preprocess_columns(df, filepath)
-        time_columns = [col for col in COLUMNS_TEMPLATE if "time" in col.lower()]
-        df = convert_time_cols(df, time_columns)
-        df = split_date_col(df)
-        df.insert(loc=0, column="Department Name", value=filepath.stem)
-        transformed_dfs.append(df)
-
-    final_df = pd.concat(transformed_dfs, ignore_index=True)
-    final_df.to_csv(OUTPUT_CSV_PATH, index=False)
+
+def process_one(filepath: Path) -> DataFrame:
+    """
+    Reads and transforms one department's Excel file.
+
+    Args:
+        filepath: Excel file to process.
+
+    Returns:
+        Transformed dataframe with the `Department Name` column.
+    """
+    df = read_excel_file(filepath)
+    df = preprocess_columns(df, filepath)
+    time_columns = [col for col in COLUMNS_TEMPLATE if "time" in col.lower()]
+    df = convert_time_cols(df, time_columns)
+    df = split_date_col(df)
+    df.insert(loc=0, column="Department Name", value=filepath.stem)
+    return df
+
+
+def main():
+    ensure_dir(OUTPUT_DIR)
+    ensure_dir(LOGS_DIR)
+
+    setup_logging(OUTPUT_LOGS_PATH)
+
+    excel_filepaths = rename_and_get_excel_filepaths(SCRIPT_DIR)
+    if not excel_filepaths:
+        logging.error(f"Excel файлы не найдены в '{SCRIPT_DIR}'\n")
+        raise ValueError(f"No Excel files found in '{SCRIPT_DIR}'")
+
+    # Files are independent of each other, so they are processed in parallel.
+    # Each result is appended to the output as soon as it arrives instead of concatenating all of them in memory.
+    # The output is only renamed to its final name once every file has been written.
+    tmp_csv_path = OUTPUT_CSV_PATH.with_name(f"{OUTPUT_CSV_PATH.name}.partial")
+    try:
+        with (
+            ProcessPoolExecutor(initializer=setup_logging, initargs=(OUTPUT_LOGS_PATH,)) as executor,
+            open(tmp_csv_path, "w", newline="", encoding="utf-8") as f,
+        ):
+            for i, df in enumerate(executor.map(process_one, excel_filepaths)):
+                df.to_csv(f, index=False, header=i == 0)
+    except BaseException:
+        tmp_csv_path.unlink(missing_ok=True)
+        raise
+    tmp_csv_path.replace(OUTPUT_CSV_PATH)
 
 
 if __name__ == "__main__":